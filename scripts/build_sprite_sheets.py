@@ -2,11 +2,20 @@
 Build sprite sheets from processed individual frames.
 Assembles rembg-processed transparent PNG frames into sprite sheet grids.
 """
+import argparse
+import json
 from pathlib import Path
 from PIL import Image
+import numpy as np
+
+from pixelate_sprites import nearest_resize
+from png_settings import PNG_FINAL_KW, PNG_KW
 
 SPRITES_DIR = Path(r"D:\Mine\claude-buddy\renderer\sprites")
 
+# Per-sheet record of the frame files each sheet was last built from
+MANIFEST_PATH = SPRITES_DIR / ".manifest.json"
+
 # Direction order in sprite sheets (rows top-to-bottom)
 # Maps: sheet row index -> file name direction part
 DIRECTIONS = ['front', 'left', 'right', 'back']  # down, left, right, up
@@ -14,91 +23,128 @@ DIRECTIONS = ['front', 'left', 'right', 'back']  # down, left, right, up
 CHAR_COLORS = ['blue', 'red', 'green', 'purple', 'orange', 'teal', 'pink', 'yellow']
 ANIMALS = ['chicken', 'cow', 'pig', 'sheep', 'cat', 'dog']
 
-def build_character_sheets():
-    """Build character sprite sheets: 3 frames x 4 directions."""
+def load_frame(path):
+    """Decode a frame PNG into an RGBA array, or None if it doesn't exist."""
+    if not path.exists():
+        return None
+    return np.asarray(Image.open(path).convert("RGBA"))
+
+def assemble_sheet(frames, fw, fh):
+    """Tile a rows x cols grid of frame arrays into one RGBA sheet array.
+
+    Frames are staged in a (rows, cols, fh, fw, 4) block and laid out with a
+    single transpose + reshape — no per-tile paste() or alpha blend. None
+    cells stay transparent.
+    """
+    rows, cols = len(frames), len(frames[0])
+    grid = np.zeros((rows, cols, fh, fw, 4), np.uint8)
+    for row, row_frames in enumerate(frames):
+        for col, frame in enumerate(row_frames):
+            if frame is None:
+                continue
+            # Resize to match if needed
+            if frame.shape[:2] != (fh, fw):
+                frame = nearest_resize(frame, fw, fh)
+            grid[row, col] = frame
+    # reshape of the transposed view copies into one contiguous sheet
+    return grid.transpose(0, 2, 1, 3, 4).reshape(rows * fh, cols * fw, 4)
+
+def sheet_from_frames(frames):
+    """Tile a frame grid at its front_0 frame's size, or None if front_0 is missing."""
+    if frames[0][0] is None:
+        return None
+    fh, fw = frames[0][0].shape[:2]
+    return assemble_sheet(frames, fw, fh)
+
+def load_manifest():
+    """Read the build manifest, or start empty if it's missing or unreadable."""
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    """Write the build manifest next to the sprites."""
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def _stat_key(path):
+    """(mtime_ns, size) of path, or None if it doesn't exist."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def build_sheet(name, frames_per_dir, png_kw, manifest):
+    """Assemble <name>_sheet.png from its frames unless the manifest shows it's current."""
+    frame_paths = [[SPRITES_DIR / f"{name}_{direction}_{col}.png"
+                    for col in range(frames_per_dir)]
+                   for direction in DIRECTIONS]
+    out_path = SPRITES_DIR / f"{name}_sheet.png"
+    frame_keys = {p.name: _stat_key(p) for row in frame_paths for p in row}
+
+    # Check if frames exist
+    if frame_keys[frame_paths[0][0].name] is None:
+        print(f"  [SKIP] {name} — no frames found")
+        return
+
+    entry = manifest.get(out_path.name)
+    if (entry is not None and entry["frames"] == frame_keys
+            and entry["compress_level"] == png_kw["compress_level"]
+            and entry["sheet"] == _stat_key(out_path)):
+        print(f"  [CACHED] {out_path.name}  unchanged")
+        return
+
+    # Decode every frame once; front_0 doubles as the size sample
+    frames = [[load_frame(path) for path in row] for row in frame_paths]
+    sheet = sheet_from_frames(frames)
+    sheet_h, sheet_w = sheet.shape[:2]
+    missing = sum(frame is None for row in frames for frame in row)
+
+    Image.fromarray(sheet, "RGBA").save(out_path, **png_kw)
+    manifest[out_path.name] = {
+        "frames": frame_keys,
+        "compress_level": png_kw["compress_level"],
+        "sheet": _stat_key(out_path),
+    }
+    status = f"({missing} missing)" if missing > 0 else "OK"
+    print(f"  [DONE] {out_path.name}  {sheet_w}x{sheet_h}  {status}")
+
+def build_character_sheets(png_kw=PNG_KW, manifest=None):
+    """Build character sprite sheets: 3 frames x 4 directions (48x64 each)."""
     print("=== Building Character Sprite Sheets ===\n")
-    frames_per_dir = 3
-
+    manifest = {} if manifest is None else manifest
     for color in CHAR_COLORS:
-        # Check if frames exist
-        test_frame = SPRITES_DIR / f"char_{color}_front_0.png"
-        if not test_frame.exists():
-            print(f"  [SKIP] char_{color} — no frames found")
-            continue
-
-        # Read first frame to get dimensions
-        sample = Image.open(test_frame)
-        fw, fh = sample.size  # should be 48x64
-        sheet_w = fw * frames_per_dir
-        sheet_h = fh * len(DIRECTIONS)
-
-        sheet = Image.new("RGBA", (sheet_w, sheet_h), (0, 0, 0, 0))
-
-        missing = 0
-        for row, direction in enumerate(DIRECTIONS):
-            for col in range(frames_per_dir):
-                frame_path = SPRITES_DIR / f"char_{color}_{direction}_{col}.png"
-                if frame_path.exists():
-                    frame = Image.open(frame_path).convert("RGBA")
-                    # Resize to match if needed
-                    if frame.size != (fw, fh):
-                        frame = frame.resize((fw, fh), Image.NEAREST)
-                    sheet.paste(frame, (col * fw, row * fh), frame)
-                else:
-                    missing += 1
-
-        out_path = SPRITES_DIR / f"char_{color}_sheet.png"
-        sheet.save(out_path)
-        status = f"({missing} missing)" if missing > 0 else "OK"
-        print(f"  [DONE] char_{color}_sheet.png  {sheet_w}x{sheet_h}  {status}")
-
+        build_sheet(f"char_{color}", 3, png_kw, manifest)
     print()
 
-def build_animal_sheets():
-    """Build animal sprite sheets: 2 frames x 4 directions."""
+def build_animal_sheets(png_kw=PNG_KW, manifest=None):
+    """Build animal sprite sheets: 2 frames x 4 directions (48x48 each)."""
     print("=== Building Animal Sprite Sheets ===\n")
-    frames_per_dir = 2
-
+    manifest = {} if manifest is None else manifest
     for animal in ANIMALS:
-        test_frame = SPRITES_DIR / f"animal_{animal}_front_0.png"
-        if not test_frame.exists():
-            print(f"  [SKIP] animal_{animal} — no frames found")
-            continue
-
-        sample = Image.open(test_frame)
-        fw, fh = sample.size  # should be 48x48
-
-        sheet_w = fw * frames_per_dir
-        sheet_h = fh * len(DIRECTIONS)
-
-        sheet = Image.new("RGBA", (sheet_w, sheet_h), (0, 0, 0, 0))
-
-        missing = 0
-        for row, direction in enumerate(DIRECTIONS):
-            for col in range(frames_per_dir):
-                frame_path = SPRITES_DIR / f"animal_{animal}_{direction}_{col}.png"
-                if frame_path.exists():
-                    frame = Image.open(frame_path).convert("RGBA")
-                    if frame.size != (fw, fh):
-                        frame = frame.resize((fw, fh), Image.NEAREST)
-                    sheet.paste(frame, (col * fw, row * fh), frame)
-                else:
-                    missing += 1
-
-        out_path = SPRITES_DIR / f"animal_{animal}_sheet.png"
-        sheet.save(out_path)
-        status = f"({missing} missing)" if missing > 0 else "OK"
-        print(f"  [DONE] animal_{animal}_sheet.png  {sheet_w}x{sheet_h}  {status}")
-
+        build_sheet(f"animal_{animal}", 2, png_kw, manifest)
     print()
 
 def main():
+    parser = argparse.ArgumentParser(description="Build sprite sheets from processed frames.")
+    parser.add_argument("--final", action="store_true",
+                        help="encode sheets with max PNG compression for shipping")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every sheet, ignoring the manifest")
+    args = parser.parse_args()
+    png_kw = PNG_FINAL_KW if args.final else PNG_KW
+    manifest = {} if args.force else load_manifest()
+
     print("=" * 50)
     print("  Sprite Sheet Builder — from processed frames")
     print("=" * 50 + "\n")
 
-    build_character_sheets()
-    build_animal_sheets()
+    build_character_sheets(png_kw, manifest)
+    build_animal_sheets(png_kw, manifest)
+    save_manifest(manifest)
 
     print("=" * 50)
     print("  Done! Sheets ready for SpriteManager.")
@@ -3,8 +3,14 @@ Pixelate post-processing for all sprites.
 Downscale + upscale with NEAREST to create consistent pixel art aesthetic.
 Also applies color quantization to reduce AI-generated gradients.
 """
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
+import numpy as np
+
+from png_settings import PNG_FINAL_KW, PNG_KW
 
 SPRITES_DIR = Path(r"D:\Mine\claude-buddy\renderer\sprites")
 
@@ -15,7 +21,13 @@ PIXEL_FACTOR_ANIMAL = 0.5    # 48x48 -> 24x24 -> 48x48
 PIXEL_FACTOR_BUILDING = 0.5  # variable -> half -> back
 
 # Color quantization: max colors per sprite (0 = skip)
-MAX_COLORS = 32
+MAX_COLORS = 64
+
+# Quantizer: "bitcrush" is a uniform palette (top bits of each channel) and
+# applies when MAX_COLORS is 8, 64 or 512 (1-3 bits/channel); other budgets
+# fall back to "mediancut", an adaptive palette per sprite — slower, but
+# closer to the source colors
+QUANTIZER = "bitcrush"
 
 CHAR_COLORS = ['blue', 'red', 'green', 'purple', 'orange', 'teal', 'pink', 'yellow']
 ANIMALS = ['chicken', 'cow', 'pig', 'sheep', 'cat', 'dog']
@@ -27,38 +39,98 @@ BUILDING_NAMES = [
 ]
 
 
-def pixelate(img, factor):
-    """Downscale then upscale with NEAREST for pixel art effect."""
-    w, h = img.size
+def _nearest_index(old, new):
+    """Source index per output pixel, exactly as Image.NEAREST picks them.
+
+    Pillow walks sample centers by repeatedly adding old/new to half a step
+    in double precision and truncating; cumsum reproduces that sequence,
+    rounding included.
+    """
+    scale = old / new
+    steps = np.full(new, scale)
+    steps[0] = scale * 0.5
+    return np.minimum(np.cumsum(steps).astype(np.int64), old - 1)
+
+
+def nearest_resize(arr, new_w, new_h):
+    """NEAREST resize of an (H, W, ...) array; same output as Image.NEAREST."""
+    h, w = arr.shape[:2]
+    return arr[_nearest_index(h, new_h)[:, None], _nearest_index(w, new_w)[None, :]]
+
+
+def _pixel_step(w, h, factor):
+    """Integer downscale step for factor, or None if it doesn't tile w x h."""
+    step = int(round(1 / factor))
+    small_w = max(1, int(w * factor))
+    small_h = max(1, int(h * factor))
+    return step if (small_w * step, small_h * step) == (w, h) else None
+
+
+def pixelate_array(arr, factor):
+    """Downscale then upscale with NEAREST on an (H, W, C) array.
+
+    Integer factors are plain subsampling + replication (Pillow samples pixel
+    centers, hence the step // 2 offset); others go through nearest_resize.
+    Alpha stays in step with RGB since everything runs on one buffer.
+    """
+    h, w = arr.shape[:2]
+    step = _pixel_step(w, h, factor)
+    if step is not None:
+        small = arr[step // 2::step, step // 2::step]
+        return np.repeat(np.repeat(small, step, 0), step, 1)
+
     small_w = max(1, int(w * factor))
     small_h = max(1, int(h * factor))
+    return nearest_resize(nearest_resize(arr, small_w, small_h), w, h)
+
+
+def _crush_bits(max_colors):
+    """Bits per channel giving exactly max_colors uniform colors, or None."""
+    for bits in (1, 2, 3):
+        if 8 ** bits == max_colors:
+            return bits
+    return None
+
+
+def _crush_table(bits):
+    """256-entry channel lookup keeping the top bits, spread over 0..255.
+
+    The kept bits are repeated into the low bits so white stays 255.
+    """
+    values = np.arange(256, dtype=np.uint16)
+    kept = values & ((0xFF << (8 - bits)) & 0xFF)
+    out = kept.copy()
+    for shift in range(bits, 8, bits):
+        out |= kept >> shift
+    return out.astype(np.uint8)
 
-    # Split alpha channel to preserve it better
-    if img.mode == 'RGBA':
-        r, g, b, a = img.split()
-        rgb = Image.merge('RGB', (r, g, b))
-
-        # Downscale RGB
-        small_rgb = rgb.resize((small_w, small_h), Image.NEAREST)
-        # Upscale RGB
-        pixel_rgb = small_rgb.resize((w, h), Image.NEAREST)
-
-        # Downscale alpha (use NEAREST to keep sharp edges)
-        small_a = a.resize((small_w, small_h), Image.NEAREST)
-        pixel_a = small_a.resize((w, h), Image.NEAREST)
-
-        # Recombine
-        pr, pg, pb = pixel_rgb.split()
-        return Image.merge('RGBA', (pr, pg, pb, pixel_a))
-    else:
-        small = img.resize((small_w, small_h), Image.NEAREST)
+
+def pixelate(img, factor):
+    """Downscale then upscale with NEAREST for pixel art effect."""
+    if img.mode != 'RGBA':
+        # Palette and other modes don't round-trip through a plain array
+        w, h = img.size
+        small = img.resize((max(1, int(w * factor)), max(1, int(h * factor))), Image.NEAREST)
         return small.resize((w, h), Image.NEAREST)
+    return Image.fromarray(pixelate_array(np.asarray(img), factor), 'RGBA')
 
 
-def quantize_colors(img, max_colors):
-    """Reduce color palette to max_colors while preserving alpha."""
+def quantize_colors(img, max_colors, method=None):
+    """Reduce color palette while preserving alpha.
+
+    "bitcrush" crushes R/G/B to a uniform max_colors palette when that is a
+    power of 8; otherwise Pillow's median cut picks at most max_colors.
+    method defaults to QUANTIZER as set at call time.
+    """
     if img.mode != 'RGBA' or max_colors <= 0:
         return img
+    method = method or QUANTIZER
+
+    bits = _crush_bits(max_colors)
+    if method == "bitcrush" and bits is not None:
+        arr = np.array(img)
+        arr[..., :3] = _crush_table(bits)[arr[..., :3]]
+        return Image.fromarray(arr, 'RGBA')
 
     # Extract alpha
     r, g, b, a = img.split()
@@ -73,74 +145,105 @@ def quantize_colors(img, max_colors):
     return Image.merge('RGBA', (qr, qg, qb, a))
 
 
+def pixelate_quantize_array(arr, factor):
+    """Pixelate + quantize an (H, W, 4) uint8 RGBA array, return a new array.
+
+    With the bit-crush quantizer both steps run on the array directly; the
+    median-cut quantizer goes through quantize_colors.
+    """
+    out = pixelate_array(arr, factor)
+    if MAX_COLORS <= 0:
+        return out
+    bits = _crush_bits(MAX_COLORS)
+    if QUANTIZER == "bitcrush" and bits is not None:
+        out[..., :3] = _crush_table(bits)[out[..., :3]]
+        return out
+    return np.asarray(quantize_colors(Image.fromarray(out, 'RGBA'), MAX_COLORS, QUANTIZER))
+
+
+def pixelate_and_quantize(path, factor, png_kw=PNG_KW):
+    """Pixelate + quantize one sprite file in place: one decode, one encode."""
+    arr = np.asarray(Image.open(path).convert("RGBA"))
+    Image.fromarray(pixelate_quantize_array(arr, factor), 'RGBA').save(path, **png_kw)
+
+
+def run_parallel(jobs):
+    """Run pixelate_and_quantize over (path, factor[, png_kw]) jobs on a thread pool.
+
+    Decode, NumPy slicing and PNG encode all release the GIL, so files
+    overlap across cores. Results come back in job order.
+    """
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        return list(ex.map(lambda job: pixelate_and_quantize(*job), jobs))
+
+
 def process_characters():
     """Pixelate all character frame sprites."""
     print("=== Pixelating Character Sprites ===\n")
-    count = 0
+    jobs = []
     for color in CHAR_COLORS:
         for direction in DIRECTIONS:
             for frame in range(3):
                 path = SPRITES_DIR / f"char_{color}_{direction}_{frame}.png"
-                if not path.exists():
-                    continue
-                img = Image.open(path).convert("RGBA")
-                img = pixelate(img, PIXEL_FACTOR_CHAR)
-                if MAX_COLORS > 0:
-                    img = quantize_colors(img, MAX_COLORS)
-                img.save(path)
-                count += 1
+                if path.exists():
+                    jobs.append((path, PIXEL_FACTOR_CHAR))
+
+    run_parallel(jobs)
+    for color in CHAR_COLORS:
         print(f"  [OK] char_{color} — 12 frames pixelated")
 
-    print(f"\n  Pixelated {count} character frames.\n")
+    print(f"\n  Pixelated {len(jobs)} character frames.\n")
 
 
 def process_animals():
     """Pixelate all animal frame sprites."""
     print("=== Pixelating Animal Sprites ===\n")
-    count = 0
+    jobs = []
     for animal in ANIMALS:
         for direction in DIRECTIONS:
             for frame in range(2):
                 path = SPRITES_DIR / f"animal_{animal}_{direction}_{frame}.png"
-                if not path.exists():
-                    continue
-                img = Image.open(path).convert("RGBA")
-                img = pixelate(img, PIXEL_FACTOR_ANIMAL)
-                if MAX_COLORS > 0:
-                    img = quantize_colors(img, MAX_COLORS)
-                img.save(path)
-                count += 1
+                if path.exists():
+                    jobs.append((path, PIXEL_FACTOR_ANIMAL))
+
+    run_parallel(jobs)
+    for animal in ANIMALS:
         print(f"  [OK] animal_{animal} — 8 frames pixelated")
 
-    print(f"\n  Pixelated {count} animal frames.\n")
+    print(f"\n  Pixelated {len(jobs)} animal frames.\n")
 
 
-def process_buildings():
+def process_buildings(png_kw=PNG_KW):
     """Pixelate all building sprites."""
     print("=== Pixelating Building Sprites ===\n")
+    jobs = []
     for name in BUILDING_NAMES:
         path = SPRITES_DIR / f"{name}.png"
         if not path.exists():
             print(f"  [SKIP] {name}.png not found")
             continue
-        img = Image.open(path).convert("RGBA")
-        img = pixelate(img, PIXEL_FACTOR_BUILDING)
-        if MAX_COLORS > 0:
-            img = quantize_colors(img, MAX_COLORS)
-        img.save(path)
-        print(f"  [OK] {name}.png pixelated")
+        jobs.append((path, PIXEL_FACTOR_BUILDING, png_kw))
+
+    run_parallel(jobs)
+    for path, *_ in jobs:
+        print(f"  [OK] {path.name} pixelated")
 
     print()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Pixelate and quantize sprite frames in place.")
+    parser.add_argument("--final", action="store_true",
+                        help="encode building sprites with max PNG compression for shipping")
+    args = parser.parse_args()
+
     print("=" * 50)
     print("  Sprite Pixelation — SNES aesthetic pass")
     print("=" * 50 + "\n")
 
     process_characters()
     process_animals()
-    process_buildings()
+    process_buildings(PNG_FINAL_KW if args.final else PNG_KW)
 
     print("=" * 50)
     print("  Done! Run build_sprite_sheets.py next to rebuild sheets.")
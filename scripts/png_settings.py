@@ -0,0 +1,8 @@
+"""
+Shared PNG encode settings for the sprite scripts.
+"""
+
+# Intermediate artifacts favor speed (zlib level 1); --final switches
+# shipped assets (sheets, building sprites) to the smallest encoding
+PNG_KW = dict(optimize=False, compress_level=1)
+PNG_FINAL_KW = dict(optimize=True, compress_level=9)
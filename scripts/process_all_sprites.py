@@ -2,12 +2,18 @@
 Process ALL sprites: remove background + resize for tile grid.
 Handles both building sprites and character sprites.
 """
+import argparse
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from io import BytesIO
-from rembg import remove
-from PIL import Image
+import numpy as np
+import onnxruntime as ort
+from PIL import Image, ImageOps
+
+from pixelate_sprites import nearest_resize
+from png_settings import PNG_FINAL_KW, PNG_KW
+from rembg_session import REMBG_MODEL, U2NET_MODELS, USE_CUDA, get_session
 
 SPRITES_DIR = Path(r"D:\Mine\claude-buddy\renderer\sprites")
 BACKUP_DIR = SPRITES_DIR / "originals_backup"
@@ -30,6 +36,15 @@ BUILDING_SIZES = {
 # Animal sprite sizes
 ANIMAL_SIZE = (48, 48)
 
+# U²-Net input spec (matches rembg's U2netSession preprocessing); the size
+# is a fallback for models exported without a fixed spatial shape
+U2NET_SIZE = (320, 320)
+U2NET_MEAN = np.array([0.485, 0.456, 0.406])
+U2NET_STD = np.array([0.229, 0.224, 0.225])
+
+# Max sprites per U²-Net forward pass
+BATCH_SIZE = 16
+
 def backup_file(src):
     """Backup original file if not already backed up."""
     name = src.stem + "_original" + src.suffix
@@ -39,38 +54,127 @@ def backup_file(src):
         return True
     return False
 
-def process_sprite(src, target_w, target_h, use_lanczos=False):
-    """Remove background, crop, resize, center on transparent canvas."""
-    with open(src, "rb") as f:
-        input_data = f.read()
+def _u2net_input(img, size):
+    """Normalize one image into a (3, H, W) float32 U²-Net input of size (W, H)."""
+    arr = np.asarray(img.convert("RGB").resize(size, Image.LANCZOS), np.float64)
+    arr = arr / max(arr.max(), 1e-6)
+    return ((arr - U2NET_MEAN) / U2NET_STD).transpose(2, 0, 1).astype(np.float32)
+
+def _run_u2net(ort_session, batch):
+    """Forward a (N, 3, H, W) batch, return the fused d0 output."""
+    model_input = ort_session.get_inputs()[0]
+    output_name = ort_session.get_outputs()[0].name
+    if "CUDAExecutionProvider" not in ort_session.get_providers():
+        return ort_session.run([output_name], {model_input.name: batch})[0]
+
+    # Upload the batch once and bind only d0, so the six side outputs never
+    # cross PCIe back to the host
+    binding = ort_session.io_binding()
+    binding.bind_ortvalue_input(model_input.name, ort.OrtValue.ortvalue_from_numpy(batch, "cuda", 0))
+    binding.bind_output(output_name)
+    ort_session.run_with_iobinding(binding)
+    return binding.copy_outputs_to_cpu()[0]
+
+def predict_masks(images):
+    """Run U²-Net once over a batch of images, return one "L" mask per image."""
+    ort_session = get_session().inner_session
+    model_input = ort_session.get_inputs()[0]
+    h, w = model_input.shape[2:]
+    size = (w, h) if isinstance(w, int) and isinstance(h, int) else U2NET_SIZE
+    batch = np.stack([_u2net_input(img, size) for img in images])
 
-    output_data = remove(input_data)
-    img = Image.open(BytesIO(output_data)).convert("RGBA")
+    if model_input.shape[0] == 1:
+        # Model exported with a fixed batch of 1: fall back to one run each
+        preds = [_run_u2net(ort_session, x[None])[0, 0] for x in batch]
+    else:
+        preds = _run_u2net(ort_session, batch)[:, 0]
 
+    masks = []
+    for img, pred in zip(images, preds):
+        lo, hi = pred.min(), pred.max()
+        pred = (pred - lo) / max(hi - lo, 1e-6)
+        mask = Image.fromarray((pred.clip(0, 1) * 255).astype(np.uint8), "L")
+        masks.append(mask.resize(img.size, Image.LANCZOS))
+    return masks
+
+def fit_sprite(img, target_w, target_h, use_lanczos=False):
+    """Crop a cutout to content, resize, center on transparent canvas.
+
+    Returns None if nothing is left after cropping.
+    """
     # Crop to content
     bbox = img.getbbox()
     if bbox:
         img = img.crop(bbox)
 
     if img.width == 0 or img.height == 0:
-        return False
+        return None
 
     # Resize to fit target, maintain aspect ratio
     ratio = min(target_w / img.width, target_h / img.height)
     new_w = max(1, int(img.width * ratio))
     new_h = max(1, int(img.height * ratio))
 
-    resample = Image.LANCZOS if use_lanczos else Image.NEAREST
-    img = img.resize((new_w, new_h), resample)
+    if use_lanczos:
+        sprite = np.asarray(img.resize((new_w, new_h), Image.LANCZOS))
+    else:
+        sprite = nearest_resize(np.asarray(img), new_w, new_h)
 
-    # Center horizontally, bottom-align vertically (anchor at feet/base)
-    canvas = Image.new("RGBA", (target_w, target_h), (0, 0, 0, 0))
+    # Center horizontally, bottom-align vertically (anchor at feet/base).
+    # The canvas is fully transparent, so a plain copy replaces paste()'s blend
+    canvas = np.zeros((target_h, target_w, 4), np.uint8)
     offset_x = (target_w - new_w) // 2
     offset_y = target_h - new_h
-    canvas.paste(img, (offset_x, offset_y), img)
+    canvas[offset_y:offset_y + new_h, offset_x:offset_x + new_w] = sprite
+    return Image.fromarray(canvas, "RGBA")
+
+def process_batch(jobs):
+    """Remove backgrounds for a list of jobs in one U²-Net pass, return a status per job."""
+    statuses = [None] * len(jobs)
+    images = {}
+    for i, (src, *_) in enumerate(jobs):
+        try:
+            images[i] = ImageOps.exif_transpose(Image.open(src)).convert("RGBA")
+        except Exception as e:
+            statuses[i] = f"ERROR: {e}"
+
+    try:
+        masks = dict(zip(images, predict_masks(list(images.values())))) if images else {}
+    except Exception as e:
+        return [status or f"ERROR: {e}" for status in statuses]
+
+    for i, img in images.items():
+        src, target_w, target_h, use_lanczos, png_kw = jobs[i]
+        try:
+            cutout = Image.composite(img, Image.new("RGBA", img.size, 0), masks[i])
+            canvas = fit_sprite(cutout, target_w, target_h, use_lanczos)
+            if canvas is None:
+                statuses[i] = "EMPTY"
+                continue
+            canvas.save(src, **png_kw)
+            statuses[i] = "OK"
+        except Exception as e:
+            statuses[i] = f"ERROR: {e}"
+    return statuses
+
+def process_sprite(src, target_w, target_h, use_lanczos=False, png_kw=PNG_KW):
+    """Remove background, crop, resize, center on transparent canvas."""
+    return process_batch([(src, target_w, target_h, use_lanczos, png_kw)])[0]
 
-    canvas.save(src)
-    return True
+def run_jobs(jobs):
+    """Run jobs in batches across worker processes, yield statuses in job order."""
+    if not jobs:
+        return
+    # One worker feeds the GPU; on CPU each worker gets an equal share of
+    # the cores for its ONNX Runtime thread pool
+    cpus = os.cpu_count() or 2
+    workers = 1 if USE_CUDA else max(1, cpus // 2)
+    size = min(BATCH_SIZE, -(-len(jobs) // workers))
+    batches = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_session,
+                             initargs=(max(1, cpus // workers),)) as ex:
+        for statuses in ex.map(process_batch, batches):
+            yield from statuses
 
 def process_characters():
     """Process all char_*_*.png sprites."""
@@ -79,25 +183,21 @@ def process_characters():
     # Skip sheet files
     char_files = [f for f in char_files if "sheet" not in f.stem]
 
+    labels = ["NEW" if backup_file(src) else "UPDATE" for src in char_files]
+    jobs = [(src, CHAR_SIZE[0], CHAR_SIZE[1], False, PNG_KW) for src in char_files]
+
     count = 0
-    for src in char_files:
-        backed_up = backup_file(src)
-        status = "NEW" if backed_up else "UPDATE"
-        print(f"  [{status}] {src.name} ...", end=" ", flush=True)
-        try:
-            if process_sprite(src, CHAR_SIZE[0], CHAR_SIZE[1]):
-                print("OK")
-                count += 1
-            else:
-                print("EMPTY")
-        except Exception as e:
-            print(f"ERROR: {e}")
+    for src, status, result in zip(char_files, labels, run_jobs(jobs)):
+        print(f"  [{status}] {src.name} ... {result}")
+        if result == "OK":
+            count += 1
 
     print(f"\n  Processed {count} character sprites.\n")
 
-def process_buildings():
+def process_buildings(png_kw=PNG_KW):
     """Process all building_*.png sprites."""
     print("=== Processing Building Sprites ===\n")
+    jobs = []
     for name, (tw, th) in BUILDING_SIZES.items():
         src = SPRITES_DIR / f"{name}.png"
         if not src.exists():
@@ -110,15 +210,10 @@ def process_buildings():
             shutil.copy2(orig, src)
         else:
             backup_file(src)
+        jobs.append((src, tw, th, True, png_kw))
 
-        print(f"  [REMBG] {name}.png -> {tw}x{th} ...", end=" ", flush=True)
-        try:
-            if process_sprite(src, tw, th, use_lanczos=True):
-                print("OK")
-            else:
-                print("EMPTY")
-        except Exception as e:
-            print(f"ERROR: {e}")
+    for (src, tw, th, *_), result in zip(jobs, run_jobs(jobs)):
+        print(f"  [REMBG] {src.name} -> {tw}x{th} ... {result}")
 
     print()
 
@@ -128,28 +223,31 @@ def process_animals():
     animal_files = sorted(SPRITES_DIR.glob("animal_*.png"))
     animal_files = [f for f in animal_files if "sheet" not in f.stem]
 
+    labels = ["NEW" if backup_file(src) else "UPDATE" for src in animal_files]
+    jobs = [(src, ANIMAL_SIZE[0], ANIMAL_SIZE[1], False, PNG_KW) for src in animal_files]
+
     count = 0
-    for src in animal_files:
-        backed_up = backup_file(src)
-        status = "NEW" if backed_up else "UPDATE"
-        print(f"  [{status}] {src.name} ...", end=" ", flush=True)
-        try:
-            if process_sprite(src, ANIMAL_SIZE[0], ANIMAL_SIZE[1]):
-                print("OK")
-                count += 1
-            else:
-                print("EMPTY")
-        except Exception as e:
-            print(f"ERROR: {e}")
+    for src, status, result in zip(animal_files, labels, run_jobs(jobs)):
+        print(f"  [{status}] {src.name} ... {result}")
+        if result == "OK":
+            count += 1
 
     print(f"\n  Processed {count} animal sprites.\n")
 
 def main():
+    parser = argparse.ArgumentParser(description="Remove backgrounds and resize all sprites.")
+    parser.add_argument("--final", action="store_true",
+                        help="encode building sprites with max PNG compression for shipping")
+    args = parser.parse_args()
+
+    if REMBG_MODEL not in U2NET_MODELS:
+        raise SystemExit(f"REMBG_MODEL {REMBG_MODEL!r} is not supported; use one of {U2NET_MODELS}")
+
     print("=" * 50)
     print("  AIFarm Sprite Processor — rembg + resize")
     print("=" * 50 + "\n")
 
-    process_buildings()
+    process_buildings(PNG_FINAL_KW if args.final else PNG_KW)
     process_characters()
     process_animals()
 
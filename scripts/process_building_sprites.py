@@ -2,10 +2,16 @@
 Process building sprites: remove background + resize for tile grid.
 Uses rembg for background removal and Pillow for resizing.
 """
+import argparse
 import os
 from pathlib import Path
 from rembg import remove
 from PIL import Image
+import numpy as np
+
+from pixelate_sprites import nearest_resize
+from png_settings import PNG_FINAL_KW, PNG_KW
+from rembg_session import get_session
 
 SPRITES_DIR = Path(r"D:\Mine\claude-buddy\renderer\sprites")
 BACKUP_DIR = SPRITES_DIR / "originals_backup"
@@ -22,7 +28,7 @@ BUILDING_SIZES = {
     "building_statue":   (96, 128),    # 3x4 tiles
 }
 
-def process_sprite(name):
+def process_sprite(name, png_kw=PNG_KW):
     src = SPRITES_DIR / f"{name}.png"
     if not src.exists():
         print(f"  [SKIP] {name}.png not found")
@@ -36,15 +42,10 @@ def process_sprite(name):
         shutil.copy2(src, backup)
         print(f"  [BACKUP] {name}_original.png")
 
-    # Load and remove background
+    # Load and remove background. Passing an Image (not bytes) makes rembg
+    # return the cutout as an Image, skipping its PNG encode + our re-decode
     print(f"  [REMBG] Processing {name}.png ...")
-    with open(src, "rb") as f:
-        input_data = f.read()
-    output_data = remove(input_data)
-
-    # Open the result
-    from io import BytesIO
-    img = Image.open(BytesIO(output_data)).convert("RGBA")
+    img = remove(Image.open(src), session=get_session()).convert("RGBA")
 
     # Crop to content (trim transparent borders)
     bbox = img.getbbox()
@@ -58,24 +59,31 @@ def process_sprite(name):
     ratio = min(target_w / img.width, target_h / img.height)
     new_w = int(img.width * ratio)
     new_h = int(img.height * ratio)
-    img = img.resize((new_w, new_h), Image.NEAREST)  # Pixel art: nearest neighbor
+    sprite = nearest_resize(np.asarray(img), new_w, new_h)  # Pixel art: nearest neighbor
 
-    # Center on transparent canvas of target size
-    canvas = Image.new("RGBA", (target_w, target_h), (0, 0, 0, 0))
+    # Center on transparent canvas of target size; nothing to blend against,
+    # so a plain copy replaces paste()
+    canvas = np.zeros((target_h, target_w, 4), np.uint8)
     offset_x = (target_w - new_w) // 2
     offset_y = target_h - new_h  # Bottom-align (anchor at base)
-    canvas.paste(img, (offset_x, offset_y), img)
+    canvas[offset_y:offset_y + new_h, offset_x:offset_x + new_w] = sprite
 
     # Save
-    canvas.save(src)
+    Image.fromarray(canvas, "RGBA").save(src, **png_kw)
     print(f"  [DONE] {name}.png -> {target_w}x{target_h} (content: {new_w}x{new_h})")
 
 def main():
+    parser = argparse.ArgumentParser(description="Remove backgrounds and resize building sprites.")
+    parser.add_argument("--final", action="store_true",
+                        help="encode building sprites with max PNG compression for shipping")
+    args = parser.parse_args()
+    png_kw = PNG_FINAL_KW if args.final else PNG_KW
+
     print("=== Building Sprite Processor ===\n")
     for name in BUILDING_SIZES:
         print(f"Processing: {name}")
         try:
-            process_sprite(name)
+            process_sprite(name, png_kw)
         except Exception as e:
             print(f"  [ERROR] {e}")
         print()
@@ -3,9 +3,22 @@ Recolor character sprites — generate orange/red from clean blue extraction.
 Blue frames have the best rembg extraction quality, so we use them as source
 and hue-shift to create consistent orange and red variants.
 """
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
 import colorsys
+import numpy as np
+
+from build_sprite_sheets import assemble_sheet, load_frame
+from png_settings import PNG_FINAL_KW, PNG_KW
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional; fall back to the NumPy path
+    njit = None
 
 SPRITES_DIR = Path(r"D:\Mine\claude-buddy\renderer\sprites")
 
@@ -53,24 +66,218 @@ def recolor_pixel(r, g, b, a, target_hue, sat_boost, val_boost):
     return r, g, b, a
 
 
+def _rgb_to_hsv(rgb):
+    """Vectorized colorsys.rgb_to_hsv over an (..., 3) float array in 0-1."""
+    mx = rgb.max(-1)
+    mn = rgb.min(-1)
+    rangec = mx - mn
+    chroma = rangec > 0
+    safe = np.where(chroma, rangec, 1.0)[..., None]
+
+    s = np.where(chroma, rangec / np.maximum(mx, 1e-9), 0.0)
+    rc, gc, bc = np.moveaxis((mx[..., None] - rgb) / safe, -1, 0)
+
+    # argmax picks the first max, matching colorsys' r -> g -> b precedence
+    channel = rgb.argmax(-1)
+    h = np.select([channel == 0, channel == 1], [bc - gc, 2.0 + rc - bc], 4.0 + gc - rc)
+    h = np.where(chroma, (h / 6.0) % 1.0, 0.0)
+    return h, s, mx
+
+
+def _hsv_to_rgb(h, s, v):
+    """Vectorized colorsys.hsv_to_rgb (6-sector formula), returns (..., 3)."""
+    h, s, v = np.broadcast_arrays(h, s, v)
+    i = (h * 6.0).astype(np.int64)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i % 6
+    r = np.choose(i, [v, q, p, p, t, v])
+    g = np.choose(i, [t, v, v, q, p, p])
+    b = np.choose(i, [p, p, t, v, v, q])
+    return np.stack([r, g, b], -1)
+
+
+def _recolor_numpy(arr, target_hue, sat_boost, val_boost):
+    """Recolor blue pixels of an (H, W, 4) uint8 array in place (NumPy)."""
+    # Integer pre-pass on packed RGBA words (little-endian view, so R is the
+    # low byte on any host). The 170-260 hue band lies inside the 120-300 arc
+    # where blue beats red, so B > R is an exact superset of the blue mask and
+    # the float HSV math below only runs on those candidates.
+    u = arr.view('<u4')[..., 0]
+    r = u & 0xFF
+    b = (u >> 16) & 0xFF
+    a = u >> 24
+    idx = np.nonzero((b > r) & (a >= 10))
+    px = arr[idx]
+
+    rgb = px[:, :3].astype(np.float64) / 255.0
+    h, s, v = _rgb_to_hsv(rgb)
+    hue_deg = h * 360
+
+    mask = (hue_deg >= BLUE_HUE_MIN) & (hue_deg <= BLUE_HUE_MAX) & (s > 0.15)
+
+    # Only blue pixels are rewritten; everything else keeps its exact bytes
+    new_h = target_hue / 360.0
+    new_s = np.minimum(1.0, s[mask] * sat_boost)
+    new_v = np.minimum(1.0, v[mask] * val_boost)
+    px[mask, :3] = (_hsv_to_rgb(new_h, new_s, new_v) * 255).astype(np.uint8)
+    arr[idx] = px
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _recolor_kernel(arr, target_hue, sat_boost, val_boost):
+        """Recolor blue pixels of an (H, W, 4) uint8 array in place (Numba).
+
+        Same math as recolor_pixel with colorsys inlined; rows run in parallel.
+        """
+        height, width = arr.shape[0], arr.shape[1]
+        new_h = target_hue / 360.0
+        for y in prange(height):
+            for x in range(width):
+                if arr[y, x, 3] < 10:
+                    continue
+
+                r = arr[y, x, 0] / 255.0
+                g = arr[y, x, 1] / 255.0
+                b = arr[y, x, 2] / 255.0
+                maxc = max(r, g, b)
+                minc = min(r, g, b)
+                if minc == maxc:
+                    continue  # Gray: s == 0, never in the blue mask
+
+                rangec = maxc - minc
+                s = rangec / maxc
+                rc = (maxc - r) / rangec
+                gc = (maxc - g) / rangec
+                bc = (maxc - b) / rangec
+                if r == maxc:
+                    h = bc - gc
+                elif g == maxc:
+                    h = 2.0 + rc - bc
+                else:
+                    h = 4.0 + gc - rc
+                hue_deg = ((h / 6.0) % 1.0) * 360
+
+                if not (BLUE_HUE_MIN <= hue_deg <= BLUE_HUE_MAX and s > 0.15):
+                    continue
+
+                new_s = min(1.0, s * sat_boost)
+                new_v = min(1.0, maxc * val_boost)
+                i = int(new_h * 6.0)
+                f = new_h * 6.0 - i
+                p = new_v * (1.0 - new_s)
+                q = new_v * (1.0 - new_s * f)
+                t = new_v * (1.0 - new_s * (1.0 - f))
+                i = i % 6
+                if i == 0:
+                    nr, ng, nb = new_v, t, p
+                elif i == 1:
+                    nr, ng, nb = q, new_v, p
+                elif i == 2:
+                    nr, ng, nb = p, new_v, t
+                elif i == 3:
+                    nr, ng, nb = p, q, new_v
+                elif i == 4:
+                    nr, ng, nb = t, p, new_v
+                else:
+                    nr, ng, nb = new_v, p, q
+                arr[y, x, 0] = int(nr * 255)
+                arr[y, x, 1] = int(ng * 255)
+                arr[y, x, 2] = int(nb * 255)
+else:
+    _recolor_kernel = None
+
+# Numba's default workqueue threading layer rejects concurrent parallel
+# launches; the kernel already spans every core, so callers take turns
+_KERNEL_LOCK = threading.Lock()
+
+
+def warm_jit():
+    """Compile and first-launch the Numba kernel; call on the main thread before any worker does."""
+    if _recolor_kernel is not None:
+        _recolor_kernel(np.zeros((1, 1, 4), np.uint8), 0.0, 1.0, 1.0)
+
+
+def recolor_inplace(arr, target_hue, sat_boost, val_boost):
+    """Recolor blue pixels of an (H, W, 4) uint8 array in place, same math as recolor_pixel."""
+    if _recolor_kernel is not None:
+        with _KERNEL_LOCK:
+            _recolor_kernel(arr, float(target_hue), float(sat_boost), float(val_boost))
+    else:
+        _recolor_numpy(arr, target_hue, sat_boost, val_boost)
+
+
 def recolor_image(img, target_hue, sat_boost, val_boost):
     """Recolor all blue pixels in an RGBA image."""
+    arr = np.array(img.convert('RGBA'))
+    recolor_inplace(arr, target_hue, sat_boost, val_boost)
+    return Image.fromarray(arr, 'RGBA')
+
+
+def recolor_frames(frames, target_hue, sat_boost, val_boost):
+    """Recolor a list of (H, W, 4) uint8 arrays through one shared color table."""
+    if not frames:
+        return []
+    words = [np.ascontiguousarray(f).view('<u4')[..., 0] for f in frames]
+    palette, inverse = np.unique(np.concatenate([w.ravel() for w in words]), return_inverse=True)
+
+    table = palette.view(np.uint8).reshape(-1, 1, 4).copy()
+    recolor_inplace(table, target_hue, sat_boost, val_boost)
+    gathered = table.reshape(-1).view('<u4')[inverse.ravel()]
+
+    out = []
+    offset = 0
+    for w in words:
+        chunk = gathered[offset:offset + w.size]
+        out.append(chunk.view(np.uint8).reshape(w.shape + (4,)))
+        offset += w.size
+    return out
+
+
+def recolor_image_exact(img, target_hue, sat_boost, val_boost):
+    """Slow scalar reference: recolor_pixel over the raw RGBA byte buffer."""
     img = img.convert('RGBA')
-    pixels = img.load()
-    w, h = img.size
+    buf = bytearray(img.tobytes())
+    for i in range(0, len(buf), 4):
+        r, g, b, a = buf[i:i + 4]
+        buf[i:i + 4] = bytes(recolor_pixel(r, g, b, a, target_hue, sat_boost, val_boost))
+    return Image.frombytes('RGBA', img.size, bytes(buf))
 
-    for y in range(h):
-        for x in range(w):
-            r, g, b, a = pixels[x, y]
-            pixels[x, y] = recolor_pixel(r, g, b, a, target_hue, sat_boost, val_boost)
 
-    return img
+def verify_recolor():
+    """Compare recolor_image and recolor_frames with recolor_image_exact on every blue frame."""
+    print("\n=== Verifying fast recolor paths ===\n")
+    checked = 0
+    mismatched = 0
+
+    sources = [SPRITES_DIR / f"char_blue_{direction}_{frame}.png"
+               for direction in DIRECTIONS for frame in range(FRAMES_PER_DIR)]
+    sources = [path for path in sources if path.exists()]
+    images = [Image.open(path).convert('RGBA') for path in sources]
+
+    for color_name, config in RECOLOR_TARGETS.items():
+        args = (config['target_hue'], config['sat_boost'], config['val_boost'])
+        batched = recolor_frames([np.asarray(img) for img in images], *args)
+        for src_path, img, table_out in zip(sources, images, batched):
+            exact = np.asarray(recolor_image_exact(img, *args))
+            for path_name, fast in (("image", np.asarray(recolor_image(img, *args))), ("frames", table_out)):
+                diff = int((fast != exact).any(-1).sum())
+                checked += 1
+                if diff:
+                    mismatched += 1
+                    print(f"  [DIFF] {color_name} ({path_name}) from {src_path.name}: {diff} pixels differ")
+
+    print(f"  Checked {checked} results, {mismatched} mismatched")
+    return mismatched == 0
 
 
 def process_color(color_name, config):
     """Recolor all blue frames to create a new color variant."""
     print(f"\n=== Recoloring blue → {color_name} ===\n")
-    count = 0
+    jobs = []
     skipped = 0
 
     for direction in DIRECTIONS:
@@ -89,16 +296,22 @@ def process_color(color_name, config):
                 skipped += 1
                 continue
 
-            img = Image.open(src_path)
-            recolored = recolor_image(img, config['target_hue'], config['sat_boost'], config['val_boost'])
-            recolored.save(dst_path)
-            count += 1
+            jobs.append((src_path, dst_path))
 
+    # Decode/encode overlap on threads (PNG codec releases the GIL); the
+    # recolor itself is one shared-table pass over all frames
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        frames = list(ex.map(lambda job: np.asarray(Image.open(job[0]).convert('RGBA')), jobs))
+        recolored = recolor_frames(frames, config['target_hue'], config['sat_boost'], config['val_boost'])
+        list(ex.map(lambda job, arr: Image.fromarray(arr, 'RGBA').save(job[1], **PNG_KW),
+                    jobs, recolored))
+
+    count = len(jobs)
     print(f"  Recolored {count} frames, skipped {skipped}")
     return count
 
 
-def rebuild_sheets():
+def rebuild_sheets(png_kw=PNG_KW):
     """Rebuild sprite sheets for recolored characters."""
     print("\n=== Rebuilding sprite sheets ===\n")
 
@@ -107,26 +320,14 @@ def rebuild_sheets():
         frame_w, frame_h = 48, 64
         cols, rows = FRAMES_PER_DIR, len(DIRECTIONS)
 
-        sheet = Image.new('RGBA', (cols * frame_w, rows * frame_h), (0, 0, 0, 0))
-
         direction_order = ['front', 'left', 'right', 'back']  # Match sprite-manager.js
-        missing = 0
-
-        for row_idx, direction in enumerate(direction_order):
-            for frame in range(cols):
-                frame_path = SPRITES_DIR / f"char_{color_name}_{direction}_{frame}.png"
-                if not frame_path.exists():
-                    missing += 1
-                    continue
+        frames = [[load_frame(SPRITES_DIR / f"char_{color_name}_{direction}_{frame}.png")
+                   for frame in range(cols)]
+                  for direction in direction_order]
+        missing = sum(frame is None for row in frames for frame in row)
 
-                frame_img = Image.open(frame_path).convert('RGBA')
-                # Resize to expected frame size if needed
-                if frame_img.size != (frame_w, frame_h):
-                    frame_img = frame_img.resize((frame_w, frame_h), Image.NEAREST)
-
-                sheet.paste(frame_img, (frame * frame_w, row_idx * frame_h))
-
-        sheet.save(sheet_path)
+        sheet = assemble_sheet(frames, frame_w, frame_h)
+        Image.fromarray(sheet, 'RGBA').save(sheet_path, **png_kw)
         print(f"  [OK] {sheet_path.name} — {cols}x{rows} grid ({missing} frames missing)")
 
     print()
@@ -150,16 +351,28 @@ def show_comparison():
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Recolor blue character frames to orange/red.")
+    parser.add_argument("--final", action="store_true",
+                        help="encode rebuilt sheets with max PNG compression for shipping")
+    parser.add_argument("--verify", action="store_true",
+                        help="check the fast recolor path against the scalar reference and exit")
+    args = parser.parse_args()
+
+    if args.verify:
+        warm_jit()
+        raise SystemExit(0 if verify_recolor() else 1)
+
     print("=" * 50)
     print("  Sprite Recoloring — Blue → Orange/Red")
     print("=" * 50)
 
     show_comparison()
+    warm_jit()
 
     for color_name, config in RECOLOR_TARGETS.items():
         process_color(color_name, config)
 
-    rebuild_sheets()
+    rebuild_sheets(PNG_FINAL_KW if args.final else PNG_KW)
     show_comparison()
 
     print("=" * 50)
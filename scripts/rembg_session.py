@@ -0,0 +1,32 @@
+"""
+Shared rembg session setup for the background-removal scripts.
+The model is loaded once per process, on the GPU when available.
+"""
+import onnxruntime as ort
+from rembg import new_session
+
+# rembg model; loaded on first use instead of on every remove() call.
+# process_all_sprites.py runs U²-Net's preprocessing itself, so it only
+# supports the u2net family listed in U2NET_MODELS
+REMBG_MODEL = "u2net"
+U2NET_MODELS = ("u2net", "u2netp", "u2net_human_seg", "silueta")
+_SESSION = None
+
+# Run U²-Net on the GPU when onnxruntime-gpu is installed, CPU otherwise
+USE_CUDA = "CUDAExecutionProvider" in ort.get_available_providers()
+if USE_CUDA:
+    REMBG_PROVIDERS = [
+        ("CUDAExecutionProvider", {"device_id": 0, "cudnn_conv_algo_search": "EXHAUSTIVE"}),
+        "CPUExecutionProvider",
+    ]
+else:
+    REMBG_PROVIDERS = ["CPUExecutionProvider"]
+
+def get_session(intra_op_threads=0):
+    """Return this process's rembg session, creating it on first call."""
+    global _SESSION
+    if _SESSION is None:
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = intra_op_threads
+        _SESSION = new_session(REMBG_MODEL, sess_opts=sess_opts, providers=REMBG_PROVIDERS)
+    return _SESSION
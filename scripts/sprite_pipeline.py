@@ -0,0 +1,132 @@
+"""
+In-memory sprite pipeline: recolor -> pixelate -> quantize -> sprite sheets.
+Runs the same steps as recolor_sprites.py, pixelate_sprites.py and
+build_sprite_sheets.py, but keeps every frame as a NumPy array between
+stages and only encodes the finished sheets. The individual frame PNGs on
+disk are read, never rewritten; use the standalone scripts for that.
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from build_sprite_sheets import ANIMALS, CHAR_COLORS, DIRECTIONS, SPRITES_DIR, load_frame, sheet_from_frames
+from pixelate_sprites import PIXEL_FACTOR_ANIMAL, PIXEL_FACTOR_CHAR, pixelate_quantize_array
+from png_settings import PNG_FINAL_KW, PNG_KW
+from recolor_sprites import RECOLOR_TARGETS, recolor_frames, warm_jit
+
+# Frames per direction in each sheet row — must match sprite-manager.js
+CHAR_FRAMES_PER_DIR = 3
+ANIMAL_FRAMES_PER_DIR = 2
+
+# Blue sources smaller than this are failed rembg extractions (see recolor_sprites.py)
+MIN_SOURCE_BYTES = 300
+
+
+def load_blue_frames():
+    """Decode the blue character frames once: {(direction, frame): array or None}."""
+    return {
+        (direction, frame): load_frame(SPRITES_DIR / f"char_blue_{direction}_{frame}.png")
+        for direction in DIRECTIONS
+        for frame in range(CHAR_FRAMES_PER_DIR)
+    }
+
+
+def character_frames(color, blue):
+    """Unprocessed frame arrays for one character color, in sheet order.
+
+    Recolor targets are hue-shifted from the blue frames in one shared-table
+    pass; a blue source that is missing or too small falls back to the
+    color's own frame on disk, as recolor_sprites.py leaves it in place.
+    """
+    keys = [(direction, frame) for direction in DIRECTIONS for frame in range(CHAR_FRAMES_PER_DIR)]
+    if color == 'blue':
+        return [blue[key] for key in keys]
+
+    own = [SPRITES_DIR / f"char_{color}_{direction}_{frame}.png" for direction, frame in keys]
+    if color not in RECOLOR_TARGETS:
+        return [load_frame(path) for path in own]
+
+    usable = [
+        blue[key] is not None
+        and (SPRITES_DIR / f"char_blue_{key[0]}_{key[1]}.png").stat().st_size >= MIN_SOURCE_BYTES
+        for key in keys
+    ]
+    config = RECOLOR_TARGETS[color]
+    recolored = iter(recolor_frames(
+        [blue[key] for key, ok in zip(keys, usable) if ok],
+        config['target_hue'], config['sat_boost'], config['val_boost'],
+    ))
+    return [next(recolored) if ok else load_frame(path) for ok, path in zip(usable, own)]
+
+
+def write_sheet(name, frames, frames_per_dir, factor, png_kw):
+    """Pixelate/quantize frames, tile them and write <name>_sheet.png.
+
+    Skips and sizes sheets like build_sprite_sheets.py: returns the number
+    of missing frames, or None if front_0 is missing.
+    """
+    if frames[0] is None:
+        return None
+
+    processed = [None if frame is None else pixelate_quantize_array(frame, factor) for frame in frames]
+    grid = [processed[i:i + frames_per_dir] for i in range(0, len(processed), frames_per_dir)]
+    sheet = sheet_from_frames(grid)
+    Image.fromarray(sheet, 'RGBA').save(SPRITES_DIR / f"{name}_sheet.png", **png_kw)
+    return sum(frame is None for frame in frames)
+
+
+def run(colors=CHAR_COLORS, animals=ANIMALS, png_kw=PNG_KW):
+    """Build character and animal sheets straight from the frame PNGs."""
+    # The kernel's first launch must not happen on a pool thread (see warm_jit)
+    warm_jit()
+    blue = load_blue_frames() if colors else {}
+
+    jobs = [
+        (f"char_{color}", lambda color=color: character_frames(color, blue),
+         CHAR_FRAMES_PER_DIR, PIXEL_FACTOR_CHAR)
+        for color in colors
+    ] + [
+        (f"animal_{animal}", lambda animal=animal: [
+            load_frame(SPRITES_DIR / f"animal_{animal}_{direction}_{frame}.png")
+            for direction in DIRECTIONS for frame in range(ANIMAL_FRAMES_PER_DIR)
+        ], ANIMAL_FRAMES_PER_DIR, PIXEL_FACTOR_ANIMAL)
+        for animal in animals
+    ]
+
+    def build(job):
+        name, get_frames, frames_per_dir, factor = job
+        return write_sheet(name, get_frames(), frames_per_dir, factor, png_kw)
+
+    # Sheets are independent; decode, NumPy and PNG encode release the GIL
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        results = list(ex.map(build, jobs))
+
+    for (name, *_), missing in zip(jobs, results):
+        if missing is None:
+            print(f"  [SKIP] {name} — no frames found")
+        else:
+            status = f"({missing} missing)" if missing > 0 else "OK"
+            print(f"  [DONE] {name}_sheet.png  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recolor, pixelate and build sprite sheets in one pass.")
+    parser.add_argument("--final", action="store_true",
+                        help="encode sheets with max PNG compression for shipping")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("  Sprite Pipeline — recolor + pixelate + sheets")
+    print("=" * 50 + "\n")
+
+    run(png_kw=PNG_FINAL_KW if args.final else PNG_KW)
+
+    print("\n" + "=" * 50)
+    print("  Done! Sheets ready for SpriteManager.")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()